@@ -1,72 +1,137 @@
 import os
-import uuid
 import json
 import dash
 import folium
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 
+from functools import lru_cache
 from dash import dcc, html
+from pandas.api.types import union_categoricals
 from dash.dependencies import Input, Output, State
 
 # === Load and Merge All Your Data ===
-hunter1 = pd.read_csv("datasets/hunter/MTA_Subway_Origin-Destination_2021_Hunter_Origin.csv")
-hunter2 = pd.read_csv("datasets/hunter/MTA_Subway_Origin-Destination_2022_Hunter_Origin.csv")
-hunter3 = pd.read_csv("datasets/hunter/MTA_Subway_Origin-Destination_2023_Hunter_Origin.csv")
-hunter4 = pd.read_csv("datasets/hunter/MTA_Subway_Origin-Destination_2024_Hunter_Origin.csv")
-hunter_total = pd.concat([hunter1, hunter2, hunter3, hunter4])
+days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Low-cardinality strings are stored as categories and the time keys as small ints;
+# day of week gets a fixed, ordered category set so lookups compare int8 codes in weekday order
+ridership_dtypes = {
+    "Year": "int16",
+    "Month": "int8",
+    "Day of Week": pd.CategoricalDtype(days, ordered=True),
+    "Hour of Day": "int8",
+    "Origin Station Complex Name": "category",
+    "Destination Station Complex Name": "category",
+}
+
+# Only these columns are read by the dashboard; everything else in the origin-destination CSVs is dropped on load
+ridership_columns = [
+    "Year", "Month", "Day of Week", "Hour of Day",
+    "Origin Station Complex ID", "Origin Station Complex Name", "Origin Latitude", "Origin Longitude",
+    "Destination Station Complex ID", "Destination Station Complex Name", "Destination Latitude", "Destination Longitude",
+    "Estimated Average Ridership",
+]
+
+def load_or_build_parquet(csv_paths, parquet_path, columns, dtypes):
+    # Reuse the parquet cache unless one of the source CSVs has changed since it was written;
+    # re-apply the dtypes so a cache written with an older schema still comes back typed as expected
+    if os.path.exists(parquet_path) and all(os.path.getmtime(parquet_path) >= os.path.getmtime(path) for path in csv_paths):
+        return pd.read_parquet(parquet_path, columns=columns).astype(dtypes)
+
+    # Read in chunks and shrink each one right away so the raw object columns are never all in memory at once
+    chunks = []
+    for path in csv_paths:
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=500_000):
+            chunks.append(chunk.astype(dtypes))
+
+    # Give every chunk the same categories so the concat keeps them categorical
+    # (columns with an explicit CategoricalDtype already share theirs)
+    for column, dtype in dtypes.items():
+        if isinstance(dtype, str) and dtype == "category":
+            categories = union_categoricals([chunk[column] for chunk in chunks]).categories
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+
+    df = pd.concat(chunks, ignore_index=True)
+    df.to_parquet(parquet_path, compression="zstd")
+    return df
+
+hunter_total = load_or_build_parquet(
+    [
+        "datasets/hunter/MTA_Subway_Origin-Destination_2021_Hunter_Origin.csv",
+        "datasets/hunter/MTA_Subway_Origin-Destination_2022_Hunter_Origin.csv",
+        "datasets/hunter/MTA_Subway_Origin-Destination_2023_Hunter_Origin.csv",
+        "datasets/hunter/MTA_Subway_Origin-Destination_2024_Hunter_Origin.csv",
+    ],
+    "datasets/hunter/MTA_Subway_Origin-Destination_2021_2024_Hunter_Origin.parquet",
+    ridership_columns,
+    ridership_dtypes,
+)
+
+# Pre-aggregate ridership per destination for every (year, month, day, hour) bucket once at startup,
+# so callbacks only sum a handful of hourly buckets instead of grouping raw trips. The groupby result
+# comes back sorted by its keys, so each callback slices it with a sorted-index lookup.
+destination_columns = ["Destination Station Complex Name", "Destination Station Complex ID", "Destination Latitude", "Destination Longitude"]
+hunter_destination_ridership = hunter_total.groupby(
+    ["Year", "Month", "Day of Week", "Hour of Day"] + destination_columns, observed=True
+)["Estimated Average Ridership"].sum()
+hunter_origin = hunter_total.iloc[0]
+
+# Only the aggregate and the origin station are used from here on, so release the raw trips
+del hunter_total
 
 geojson_file = "datasets/nyc_zipcode_geodata/nyc-zip-code-tabulation-areas-polygons.geojson"
 gdf = gpd.read_file(geojson_file)
-zip_coords = pd.read_csv("datasets/nyc_zipcode_geodata/uszipcodes_geodata.csv")
 income_data = pd.read_csv("datasets/nyc_median_income_zipcode.csv")
 mta_stations = pd.read_csv("datasets/MTA_Subway_Stations_and_Complexes_20250225.csv")
 
 gdf["postalCode"] = gdf["postalCode"].astype(str)
-zip_coords["ZIP"] = zip_coords["ZIP"].astype(str)
 income_data["zipcode"] = income_data["zipcode"].astype(str)
 
-gdf = gdf.merge(zip_coords, left_on="postalCode", right_on="ZIP", how="left")
-gdf = gdf.merge(income_data, left_on="postalCode", right_on="zipcode", how="left")
-geojson_data = json.loads(gdf.to_json())
+# Only the median income is used downstream, so join just that column on an indexed ZIP lookup
+gdf = gdf.join(income_data.set_index("zipcode")["income_household_median"], on="postalCode")
+
+# Bake the income fill color into each ZIP feature so the map needs no per-polygon color logic
+income = gdf["income_household_median"]
+gdf["fillColor"] = np.select(
+    [income.isna(), income < 50000, income < 100000, income < 150000, income < 200000],
+    ["gray", "red", "orange", "yellow", "lightgreen"],
+    default="green",
+)
+
+# Ship only what the tooltip and style need, with polygons simplified to ~10 m (plenty at zoom 11)
+zip_shapes = gdf[["postalCode", "income_household_median", "fillColor", "geometry"]].copy()
+zip_shapes["geometry"] = zip_shapes.geometry.simplify(tolerance=1e-4, preserve_topology=True)
+geojson_data = json.loads(zip_shapes.to_json())
+
+# Attach each station to the ZIP it sits in with one spatial join, for the median income in marker popups
+stations_gdf = gpd.GeoDataFrame(
+    mta_stations,
+    geometry=gpd.points_from_xy(mta_stations["Longitude"], mta_stations["Latitude"]),
+    crs=gdf.crs,
+)
+station_zips = gpd.sjoin(stations_gdf, gdf[["postalCode", "income_household_median", "geometry"]], predicate="within")
+station_income = station_zips.drop_duplicates("Complex ID").set_index("Complex ID")["income_household_median"].to_dict()
 
 # === Utility Functions ===
-def get_income_color(income):
-    if pd.isna(income):
-        return "gray"
-    elif income < 50000:
-        return "red"
-    elif income < 100000:
-        return "orange"
-    elif income < 150000:
-        return "yellow"
-    elif income < 200000:
-        return "lightgreen"
-    else:
-        return "green"
-
-def top_station_destinations(ridership_df, top_n=5):
-    top_destinations = ridership_df.groupby(
-        ["Destination Station Complex Name", "Destination Station Complex ID", "Destination Latitude", "Destination Longitude"]
-    )["Estimated Average Ridership"].sum().sort_values(ascending=False).head(top_n)
+def top_station_destinations(destination_ridership, top_n=5):
+    top_destinations = destination_ridership.groupby(
+        level=destination_columns, observed=True
+    ).sum().nlargest(top_n)
     return top_destinations
 
-def top_destination_income_map(ridership_df, top_n, start_time, end_time, day_of_week, month, year):
-    df = ridership_df[
-        (ridership_df["Hour of Day"] >= start_time) &
-        (ridership_df["Hour of Day"] <= end_time) &
-        (ridership_df["Day of Week"] == day_of_week) &
-        (ridership_df["Month"] == month) &
-        (ridership_df["Year"] == year)
-    ]
+def circle_marker(lat, lon, radius, color, popup, tooltip):
+    return {"lat": lat, "lon": lon, "radius": radius, "color": color, "popup": popup, "tooltip": str(tooltip)}
 
+def build_base_map():
     m = folium.Map(location=[40.7128, -74.0060], zoom_start=11)
 
     folium.GeoJson(
         geojson_data,
         name="NYC Neighborhoods",
         style_function=lambda x: {
-            "fillColor": get_income_color(x["properties"].get("income_household_median", None)),
+            "fillColor": x["properties"]["fillColor"],
             "color": "black",
             "weight": 1,
             "fillOpacity": 0.6,
@@ -78,58 +143,115 @@ def top_destination_income_map(ridership_df, top_n, start_time, end_time, day_of
         ),
     ).add_to(m)
 
-    top_destinations_df = top_station_destinations(df, top_n)
-    if isinstance(top_destinations_df, pd.Series):
-        top_destinations_df = top_destinations_df.reset_index()
-
-    max_ridership = top_destinations_df["Estimated Average Ridership"].max()
-    min_radius = 5
-    max_radius = 15
-
-    for _, row in top_destinations_df.iterrows():
-        if pd.notna(row["Destination Latitude"]) and pd.notna(row["Destination Longitude"]):
-            ridership = row["Estimated Average Ridership"]
-            radius = min_radius + (ridership / max_ridership) * (max_radius - min_radius)
-
-            folium.CircleMarker(
-                location=[row["Destination Latitude"], row["Destination Longitude"]],
-                radius=radius,
-                color="blue",
-                fill=True,
-                fill_color="blue",
-                fill_opacity=0.7,
-                popup=folium.Popup(
-                    f"Station: {row['Destination Station Complex Name']}<br>"
-                    f"Station ID: {row['Destination Station Complex ID']}<br>"
-                    f"Ridership: {ridership:,.0f}",
-                    max_width=300,
-                ),
-                tooltip=row["Destination Station Complex Name"],
-            ).add_to(m)
+    return m.get_name(), m.get_root().render()
+
+def top_destination_markers(destination_ridership, origin_station, top_n, start_time, end_time, day_of_week, month, year):
+    try:
+        df = destination_ridership.loc[(year, month, day_of_week, slice(start_time, end_time))]
+    except KeyError:
+        df = destination_ridership.iloc[0:0]
+
+    top_destinations_df = top_station_destinations(df, top_n).reset_index()
+
+    # A missing bucket (or a cleared day dropdown) leaves nothing to plot but the origin
+    markers = []
+    if not top_destinations_df.empty:
+        max_ridership = top_destinations_df["Estimated Average Ridership"].max()
+        min_radius = 5
+        max_radius = 15
+
+        # Build radii and popup text column-wise, then loop over plain tuples to collect the markers.
+        # The startup groupby already dropped destinations without coordinates, so no NaN filter is needed here.
+        ridership = top_destinations_df["Estimated Average Ridership"]
+        radii = min_radius + (ridership / max_ridership) * (max_radius - min_radius)
+        names = top_destinations_df["Destination Station Complex Name"].astype(str)
+        incomes = top_destinations_df["Destination Station Complex ID"].map(station_income)
+        popups = (
+            "Station: " + names
+            + "<br>Station ID: " + top_destinations_df["Destination Station Complex ID"].astype(str)
+            + "<br>Ridership: " + ridership.map("{:,.0f}".format)
+            + "<br>ZIP Median Income: " + incomes.map(lambda value: f"${value:,.0f}" if pd.notna(value) else "N/A")
+        )
+
+        markers = [
+            circle_marker(lat, lon, radius=radius, color="blue", popup=popup, tooltip=name)
+            for lat, lon, radius, popup, name in zip(
+                top_destinations_df["Destination Latitude"].tolist(),
+                top_destinations_df["Destination Longitude"].tolist(),
+                radii.tolist(),
+                popups.tolist(),
+                names.tolist(),
+            )
+        ]
 
     if not df.empty:
-        origin_df = df.iloc[0]
-        folium.CircleMarker(
-            location=[origin_df["Origin Latitude"], origin_df["Origin Longitude"]],
+        markers.append(circle_marker(
+            float(origin_station["Origin Latitude"]),
+            float(origin_station["Origin Longitude"]),
             radius=10,
             color="red",
-            fill=True,
-            fill_color="red",
-            fill_opacity=0.7,
-            popup=folium.Popup(
-                f"Station: {origin_df['Origin Station Complex Name']}<br>"
-                f"Station ID: {origin_df['Origin Station Complex ID']}",
-                max_width=300,
+            popup=(
+                f"Station: {origin_station['Origin Station Complex Name']}<br>"
+                f"Station ID: {origin_station['Origin Station Complex ID']}"
             ),
-            tooltip=origin_df["Origin Station Complex Name"],
-        ).add_to(m)
+            tooltip=origin_station["Origin Station Complex Name"],
+        ))
+    return markers
+
+# === Static Base Map ===
+# The iframe loads this page once; each tick only ships its marker list to the browser
+base_map_name, base_map_html = build_base_map()
+
+# Play mode keeps cycling through the same slider states, so memoize the (small) marker list per state
+@lru_cache(maxsize=4096)
+def timelapse_markers(year, month, hour, day, top_n):
+    return top_destination_markers(
+        hunter_destination_ridership,
+        hunter_origin,
+        top_n=top_n,
+        start_time=hour,
+        end_time=hour + 1,
+        day_of_week=day,
+        month=month,
+        year=year,
+    )
 
-    return m
+# Draws the marker list into the folium map inside the iframe, waiting for the iframe to load if needed
+markers_clientside_js = """
+function(markers) {
+    var frame = document.getElementById("map");
+    var draw = function() {
+        var win = frame.contentWindow;
+        var map = win[MAP_NAME];
+        if (!win.timelapseMarkers) {
+            win.timelapseMarkers = win.L.layerGroup().addTo(map);
+        }
+        win.timelapseMarkers.clearLayers();
+        markers.forEach(function(m) {
+            win.L.circleMarker([m.lat, m.lon], {
+                radius: m.radius, color: m.color, fill: true, fillColor: m.color, fillOpacity: 0.7
+            }).bindPopup(m.popup, {maxWidth: 300}).bindTooltip(m.tooltip).addTo(win.timelapseMarkers);
+        });
+    };
+    var win = frame && frame.contentWindow;
+    if (win && win.document.readyState === "complete" && win[MAP_NAME]) {
+        draw();
+    } else if (frame) {
+        frame.addEventListener("load", draw, {once: true});
+    }
+    return markers.length;
+}
+""".replace("MAP_NAME", json.dumps(base_map_name))
 
 # === Dash App ===
 app = dash.Dash(__name__)
 
-days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+# Initial control values, shared by the controls and the markers the map starts with
+DEFAULT_YEAR = 2021
+DEFAULT_MONTH = 1
+DEFAULT_HOUR = 8
+DEFAULT_DAY = "Monday"
+DEFAULT_TOP_N = 15
 
 app.layout = html.Div([
     html.H1("Top Ridership Destination Timelapse", style={"textAlign": "center"}),
@@ -141,13 +263,13 @@ app.layout = html.Div([
 
     html.Div([
         html.Label("Month"),
-        dcc.Slider(id="month-slider", min=1, max=12, step=1, value=1,
+        dcc.Slider(id="month-slider", min=1, max=12, step=1, value=DEFAULT_MONTH,
                    marks={i: str(i) for i in range(1, 13)}),
     ], style={"padding": "10px"}),
 
     html.Div([
         html.Label("Hour"),
-        dcc.Slider(id="hour-slider", min=0, max=23, step=1, value=8,
+        dcc.Slider(id="hour-slider", min=0, max=23, step=1, value=DEFAULT_HOUR,
                    marks={i: str(i) for i in range(0, 24, 3)}),
     ], style={"padding": "10px"}),
 
@@ -156,33 +278,37 @@ app.layout = html.Div([
         dcc.Dropdown(
             id="day-dropdown",
             options=[{"label": day, "value": day} for day in days],
-            value="Monday"
+            value=DEFAULT_DAY
         )
     ], style={"padding": "10px", "width": "300px"}),
 
     html.Div([
         html.Label("Top N Destinations"),
-        dcc.Slider(id="top-n-slider", min=5, max=30, step=5, value=15,
+        dcc.Slider(id="top-n-slider", min=5, max=30, step=5, value=DEFAULT_TOP_N,
                    marks={i: str(i) for i in range(5, 31, 5)}),
     ], style={"padding": "10px"}),
 
     html.Div([
         html.Label("Year"),
-        dcc.Slider(id="year-slider", min=2021, max=2024, step=1, value=2021,
+        dcc.Slider(id="year-slider", min=2021, max=2024, step=1, value=DEFAULT_YEAR,
                 marks={i: str(i) for i in range(2021, 2025)}),
     ], style={"padding": "10px"}),
 
-    html.Iframe(id="map", width="100%", height="600")
+    html.Iframe(id="map", srcDoc=base_map_html, width="100%", height="600"),
+    # Markers for the initial slider values are computed up front, so the marker callback can skip Dash's initial call
+    dcc.Store(id="map-markers", data=timelapse_markers(DEFAULT_YEAR, DEFAULT_MONTH, DEFAULT_HOUR, DEFAULT_DAY, DEFAULT_TOP_N)),
+    html.Div(id="map-marker-count", style={"display": "none"}),
 ])
 
 # === Toggle Play Button ===
+# Derive the state from the click count so overlapping callbacks can never flip it twice
 @app.callback(
     Output("play-interval", "disabled"),
     Input("play-button", "n_clicks"),
-    State("play-interval", "disabled")
+    prevent_initial_call=True,
 )
-def toggle_play(n_clicks, disabled):
-    return not disabled
+def toggle_play(n_clicks):
+    return n_clicks % 2 == 0
 
 # === Advance Time Every Tick ===
 @app.callback(
@@ -195,6 +321,7 @@ def toggle_play(n_clicks, disabled):
     State("day-dropdown", "value"),
     State("year-slider", "value"),
     State("month-slider", "value"),
+    prevent_initial_call=True,
 )
 def advance_time(n, hour, day, year, month):
     day_index = days.index(day)
@@ -214,30 +341,22 @@ def advance_time(n, hour, day, year, month):
 
 # === Update Map ===
 @app.callback(
-    Output("map", "srcDoc"),
+    Output("map-markers", "data"),
     Input("year-slider", "value"),
     Input("month-slider", "value"),
     Input("hour-slider", "value"),
     Input("day-dropdown", "value"),
     Input("top-n-slider", "value"),
+    prevent_initial_call=True,
 )
 def update_map(year, month, hour, day, top_n):
-    folium_map = top_destination_income_map(
-        hunter_total,
-        top_n=top_n,
-        start_time=hour,
-        end_time=hour + 1,
-        day_of_week=day,
-        month=month,
-        year=year,
-    )
+    return timelapse_markers(year, month, hour, day, top_n)
 
-    tmp_file = f"temp_map_{uuid.uuid4().hex}.html"
-    folium_map.save(tmp_file)
-    with open(tmp_file, "r", encoding="utf-8") as f:
-        html_content = f.read()
-    os.remove(tmp_file)
-    return html_content
+app.clientside_callback(
+    markers_clientside_js,
+    Output("map-marker-count", "children"),
+    Input("map-markers", "data"),
+)
 
 if __name__ == "__main__":
     app.run(debug=True)
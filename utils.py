@@ -5,20 +5,38 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from functools import lru_cache
+
+YEARS = [2021, 2022, 2023, 2024]
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Function to total the trips to each destination station, by estimated ridership or by number of records
+def station_destination_totals(ridership_df, metric="ridership"):
+    grouped_ridership_df = ridership_df.groupby("Destination Station Complex Name")
+    if metric == "ridership":
+        return grouped_ridership_df["Estimated Average Ridership"].sum()
+    elif metric == "count":
+        return grouped_ridership_df.size()
+    else:
+        raise ValueError(f"Unknown metric: {metric} (expected 'ridership' or 'count')")
+
+
 # Function to get the top station origins
-def top_station_destinations(ridership_df, top_n=5):
-    top_destinations = ridership_df.groupby("Destination Station Complex Name")["Estimated Average Ridership"].sum().sort_values(ascending=False).head(top_n)
+def top_station_destinations(ridership_df, top_n=5, metric="ridership"):
+    top_destinations = station_destination_totals(ridership_df, metric).nlargest(top_n)
     return top_destinations
 
 
 # Function to get the bottom station destinations
-def bottom_station_destinations(ridership_df, bottom_n=5):
-    top_destinations = ridership_df.groupby("Destination Station Complex Name")["Estimated Average Ridership"].sum().sort_values(ascending=True).head(bottom_n)
-    return top_destinations
+def bottom_station_destinations(ridership_df, bottom_n=5, metric="ridership"):
+    bottom_destinations = station_destination_totals(ridership_df, metric).nsmallest(bottom_n)
+    return bottom_destinations
 
 
 # Function to visualize the top destinations for a given station
-def origin_destination_visualizer(ridership_df, station_df, top_n = 5):
+def origin_destination_visualizer(ridership_df, station_df=None, top_n = 5):
+    if station_df is None:
+        station_df = _get_stations()
 
     # Get ridership data for the origin station and group by destination
     grouped_ridership_df = ridership_df.groupby("Destination Station Complex ID")
@@ -39,13 +57,19 @@ def origin_destination_visualizer(ridership_df, station_df, top_n = 5):
         icon=folium.Icon(color='blue')
     ).add_to(m)
 
+    # Index the stations by complex once (first stop per complex) so each destination is a direct lookup
+    station_lookup = station_df.drop_duplicates("Complex ID").set_index("Complex ID")
+
     # Add markers for the top destinations
-    for dest_id, count in grouped_ridership_df["Estimated Average Ridership"].sum().sort_values(ascending=False).head(top_n).items():
+    for dest_id, count in grouped_ridership_df["Estimated Average Ridership"].sum().nlargest(top_n).items():
+        if dest_id not in station_lookup.index:
+            continue
+
         # Get destination station information
-        dest_df = station_df[station_df["Complex ID"] == dest_id]
-        dest_lat = dest_df["Latitude"]
-        dest_lon = dest_df["Longitude"]
-        dest_name = dest_df["Stop Name"]
+        dest_station = station_lookup.loc[dest_id]
+        dest_lat = dest_station["Latitude"]
+        dest_lon = dest_station["Longitude"]
+        dest_name = dest_station["Stop Name"]
         
         # Add a marker for the destination station
         folium.Marker(
@@ -56,7 +80,17 @@ def origin_destination_visualizer(ridership_df, station_df, top_n = 5):
 
     return m
 
-station_df = pd.read_csv("datasets/MTA_Subway_Stations_and_Complexes_20250225.csv")
+# Function to load the MTA station table on first use, so importing this module doesn't read the CSV
+@lru_cache(maxsize=1)
+def _get_stations():
+    return pd.read_csv("datasets/MTA_Subway_Stations_and_Complexes_20250225.csv")
+
+
+# Keep `utils.station_df` working for existing callers, loaded lazily through _get_stations()
+def __getattr__(name):
+    if name == "station_df":
+        return _get_stations()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 
@@ -66,7 +100,7 @@ def plot_weekday_histogram(df, year, month):
 
     # Set plot style
     plt.figure(figsize=(10, 6))
-    sns.barplot(data=df_filtered, x="DayOfWeek", y="Ridership", order=["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"], palette="Blues")
+    sns.barplot(data=df_filtered, x="DayOfWeek", y="Ridership", order=DAYS_OF_WEEK, palette="Blues")
 
     # Labels and title
     plt.xlabel("Day of the Week")
@@ -79,24 +113,30 @@ def plot_weekday_histogram(df, year, month):
 
 
 
+# Function to sum the ridership for a station by (year, month, day of week) in a single pass
+def station_daily_ridership(station_id, dataset):
+    station_ridership = dataset.loc[dataset["Destination Station Complex ID"] == station_id,
+                                    ["Year", "Month", "Day of Week", "Estimated Average Ridership"]]
+    # Series.sum per group (not the groupby's compensated sum) so totals match summing each day's rows directly
+    daily_ridership = station_ridership.groupby(["Year", "Month", "Day of Week"])["Estimated Average Ridership"].agg(lambda s: s.sum())
+    return daily_ridership.to_dict()
+
+
+
 # Function to calculate average ridership for a station and return a DataFrame
 def average_ridership_df(station_id, dataset):
     data = []  # List to store dictionary records
     
-    average_ridership = dataset[dataset["Destination Station Complex ID"] == station_id]
+    daily_ridership = station_daily_ridership(station_id, dataset)
     
-    for year in [2021, 2022, 2023, 2024]:
+    for year in YEARS:
         yearly_ridership = 0
 
         for month in range(1, 13):
             monthly_ridership = 0
 
-            for day in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]:
-                amount = average_ridership[
-                    (average_ridership["Year"] == year) & 
-                    (average_ridership["Month"] == month) & 
-                    (average_ridership["Day of Week"] == day)
-                ]["Estimated Average Ridership"].sum()
+            for day in DAYS_OF_WEEK:
+                amount = daily_ridership.get((year, month, day), 0.0)
                 
                 adjusted_amount = amount * 4  # Adjusted for 4 weeks per month
                 
@@ -128,8 +168,9 @@ def average_ridership_df(station_id, dataset):
             "Ridership": yearly_ridership
         })
     
-    # Convert list of records into a DataFrame
+    # Convert list of records into a DataFrame, with Ridership guaranteed numeric for the plotting helpers
     df = pd.DataFrame(data)
+    df["Ridership"] = df["Ridership"].astype("float64")
     return df
 
 
@@ -137,10 +178,10 @@ def average_ridership_df(station_id, dataset):
 # Function to write average ridership information to a file
 def average_ridership_info(station_id, dataset, output_file):
     with open(output_file, "w") as file:
-        average_ridership = dataset[(dataset["Destination Station Complex ID"] == station_id)]
+        daily_ridership = station_daily_ridership(station_id, dataset)
 
         total_ridership_four_years = 0
-        for year in [2021, 2022, 2023, 2024]:
+        for year in YEARS:
             file.write(f"Year: {year}\n")
             yearly_ridership = 0
             
@@ -148,10 +189,8 @@ def average_ridership_info(station_id, dataset, output_file):
                 file.write(f"Month: {month}\n")
                 monthly_ridership = 0
                 
-                for day in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]:
-                    amount = average_ridership[(average_ridership["Year"] == year) & 
-                                               (average_ridership["Month"] == month) & 
-                                               (average_ridership["Day of Week"] == day)]["Estimated Average Ridership"].sum()
+                for day in DAYS_OF_WEEK:
+                    amount = daily_ridership.get((year, month, day), 0.0)
                     file.write(f"{day}: {amount * 4}\n")
                     monthly_ridership += amount * 4
 
@@ -168,8 +207,7 @@ def average_ridership_info(station_id, dataset, output_file):
 # Function to plot the ridership histogram
 def plot_yearly_ridership(df):
     """Plots the yearly ridership histogram."""
-    df_filtered = df[df["DayOfWeek"] != "Total"]
-    df_filtered["Ridership"] = pd.to_numeric(df_filtered["Ridership"])
+    df_filtered = df.loc[df["DayOfWeek"] != "Total", ["Year", "Ridership"]]
     
     yearly_ridership = df_filtered.groupby("Year")["Ridership"].sum()
 
@@ -186,8 +224,7 @@ def plot_yearly_ridership(df):
 # Function to plot the monthly ridership histogram
 def plot_monthly_ridership(df):
     """Plots the monthly ridership histogram."""
-    df_filtered = df[df["DayOfWeek"] != "Total"]  # Remove "Total" rows
-    df_filtered["Ridership"] = pd.to_numeric(df_filtered["Ridership"])
+    df_filtered = df.loc[df["DayOfWeek"] != "Total", ["Month", "Ridership"]]  # Remove "Total" rows
     
     monthly_ridership = df_filtered.groupby("Month")["Ridership"].sum()
 